@@ -1,6 +1,45 @@
+import atexit
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Thread/process info isn't in our log format, don't collect it for every record
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+
+
+class FastRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that only stats the log file when a rollover is actually due"""
+
+    _formatted = None
+
+    def format(self, record):
+        # shouldRollover and emit both format the record; do it once per emit
+        if self._formatted is not None and self._formatted[0] is record:
+            return self._formatted[1]
+        msg = super().format(record)
+        self._formatted = (record, msg)
+        return msg
+
+    def emit(self, record):
+        try:
+            super().emit(record)
+        finally:
+            self._formatted = None
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        if self.maxBytes <= 0:
+            return False
+
+        # Cheap size check first; the parent stats the file on every call
+        pos = self.stream.tell()
+        if not pos or pos + len(self.format(record)) + len(self.terminator) < self.maxBytes:
+            return False
+        return super().shouldRollover(record)
 
 
 class Logger:
@@ -21,12 +60,17 @@ class Logger:
         log_file = os.path.join(log_dir, 'vpn_nexus_manager.log')
 
         # Use RotatingFileHandler to limit log file size
-        file_handler = RotatingFileHandler(log_file, maxBytes=5 * 1024 * 1024,
-                                           backupCount=3)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s:%(lineno)d - %(pathname)s - %(message)s')
+        file_handler = FastRotatingFileHandler(log_file, maxBytes=5 * 1024 * 1024,
+                                               backupCount=3)
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
         file_handler.setFormatter(formatter)
 
-        self.logger.addHandler(file_handler)
+        # Callers only enqueue records; a listener thread does the file I/O
+        log_queue = queue.Queue(-1)
+        self.logger.addHandler(QueueHandler(log_queue))
+        self.listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
 
     def get_logger(self):
         return self.logger
@@ -1,3 +1,5 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Form, HTTPException
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
@@ -6,7 +8,13 @@ from .vpn_manager import AdvancedVPNNexusManager
 from .logging_utility import logger
 
 
-app = FastAPI(title="PiVPN Nexus")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Starting PiVPN Nexus application")
+    yield
+
+
+app = FastAPI(title="PiVPN Nexus", lifespan=lifespan)
 vpn_manager = AdvancedVPNNexusManager('config/vpn_nexus_manager.conf')
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -16,11 +24,22 @@ class VPNProvider(BaseModel):
     name: str
     config_path: str
 
+
+# Setup/cleanup used to be serialized by the blocked event loop; keep them exclusive
+chain_lock = asyncio.Lock()
+
+
+async def run_blocking(func, *args):
+    """Run a blocking VPN manager call without stalling the event loop"""
+    # Same default pool the manager itself uses for its blocking steps
+    return await asyncio.to_thread(func, *args)
+
+
 @app.get("/")
 async def home(request: Request):
     """Home page with current IP display"""
     try:
-        current_ip = vpn_manager.get_current_ip()
+        current_ip = await run_blocking(vpn_manager.get_current_ip)
         return templates.TemplateResponse("index.html", {
             "request": request,
             "current_ip": current_ip
@@ -34,7 +53,8 @@ async def home(request: Request):
 async def setup_chain(num_hops: int = 2):
     """Set up VPN chain with specified number of hops"""
     try:
-        success = vpn_manager.setup_vpn_chain(num_hops)
+        async with chain_lock:
+            success = await vpn_manager.setup_vpn_chain(num_hops)
         if success:
             return {"status": "success", "message": f"VPN chain with {num_hops} hops established"}
         else:
@@ -48,7 +68,8 @@ async def setup_chain(num_hops: int = 2):
 async def cleanup_chain():
     """Clean up all VPN connections and SOCKS proxies"""
     try:
-        vpn_manager.cleanup_vpn_chain()
+        async with chain_lock:
+            await run_blocking(vpn_manager.cleanup_vpn_chain)
         return {"status": "success", "message": "VPN chain cleaned up"}
     except Exception as e:
         logger.error(f"Error cleaning up VPN chain: {str(e)}")
@@ -59,7 +80,7 @@ async def cleanup_chain():
 async def get_current_ip():
     """Get current public IP address through the VPN chain"""
     try:
-        ip = vpn_manager.get_current_ip()
+        ip = await run_blocking(vpn_manager.get_current_ip)
         if ip:
             return {"ip": ip}
         else:
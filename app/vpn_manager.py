@@ -1,25 +1,106 @@
+import asyncio
 import configparser
 import subprocess
-import time
+from functools import lru_cache
 from pathlib import Path
 import os
+import shutil
+import socket
+import threading
+import time
+from types import MappingProxyType
+import httpx
 from .logging_utility import logger
 
+try:
+    from pyroute2 import IPRoute
+except ImportError:
+    IPRoute = None
+
+
+# Fixed command lines, built once at import
+SHOW_ROUTES = ("ip", "route", "show")
+SHOW_INTERFACES = ("ip", "addr")
+KILL_VPN = ("sudo", "kill")
+OPENVPN_START = ("sudo", "openvpn", "--daemon", "--verb", "4")
+VPN_CREDENTIALS = "/home/anyone/.prjcts/pivpn-nexus/config/test/vpn-credentials.txt"
+# Seconds a looked-up public IP is reused; chain setup/cleanup invalidates it
+CURRENT_IP_TTL = 60
+# Plain-text endpoint; bare ifconfig.me only answers plain text to curl's user agent
+IP_CHECK_URL = "https://ifconfig.me/ip"
+
+
+def check_ip_command(interface):
+    """Command that reports the public IP seen through the given interface"""
+    return ("curl", "--interface", interface, "--silent", "--max-time", "10", "ifconfig.me")
+
+
+@lru_cache(maxsize=None)
+def tool_path(name):
+    """Absolute path of a binary, also searching sbin; resolved once per process"""
+    search_path = os.pathsep.join([os.environ.get("PATH", ""), "/usr/sbin", "/sbin"])
+    return shutil.which(name, path=search_path)
+
+
+def run_quiet(cmd, check=False, input=None):
+    """Run a fire-and-forget command; output is discarded rather than piped and decoded"""
+    return subprocess.run(cmd, input=input, text=input is not None,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=check)
+
+
+@lru_cache(maxsize=8)
+def _load_config_cached(path, mtime_ns):
+    """Parse the ini into read-only mappings; mtime_ns in the key invalidates on edit"""
+    config = configparser.ConfigParser()
+    config.read(path)
+    return MappingProxyType({
+        section: MappingProxyType(dict(config[section]))
+        for section in config.sections()
+    })
+
+
+def openvpn_command(config_path, log_path, pid_path):
+    """Command that daemonises OpenVPN for one hop"""
+    return OPENVPN_START + ("--config", os.fspath(config_path),
+                            "--auth-user-pass", VPN_CREDENTIALS,
+                            "--log", os.fspath(log_path),
+                            "--writepid", os.fspath(pid_path))
 
 
 class AdvancedVPNNexusManager:
     def __init__(self, config_file: str):
         self.config = self._load_config(config_file)
+        self.providers = tuple(self.config.items())
         self.base_path = Path(__file__).parent.parent
+        self._log_dir = self.base_path / "logs"
+        self._first_log = self._log_dir / "first_vpn.log"
+        self._second_log = self._log_dir / "second_vpn.log"
+        self._log_files = (self._first_log, self._second_log)
+        # OpenVPN writes its daemon PID here, so cleanup only signals our own processes
+        self._first_pid = self._log_dir / "first_vpn.pid"
+        self._second_pid = self._log_dir / "second_vpn.pid"
+        self._pid_files = (self._first_pid, self._second_pid)
         self.socks_ports = {}
         self.vpn1_table = 11
         self.vpn2_table = 12
+        # interface -> (bound address, keep-alive client) for public IP checks
+        self._ip_clients = {}
+        self._ip_clients_lock = threading.Lock()
+        # Exit tunnel of the chain this manager set up, None when there is none
+        self._active_tun = None
+        # (monotonic expiry, interface, ip) of the last get_current_ip answer
+        self._ip_cache = (0.0, None, None)
 
     @staticmethod
-    def _load_config(config_file: str) -> configparser.ConfigParser:
-        config = configparser.ConfigParser()
-        config.read(config_file)
-        return config
+    def _load_config(config_file: str) -> MappingProxyType:
+        """Parse the ini once into plain dicts so lookups skip configparser"""
+        path = Path(config_file).resolve()
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            # ConfigParser.read() silently skips missing files; keep that behaviour
+            mtime_ns = None
+        return _load_config_cached(str(path), mtime_ns)
 
     def _setup_routing_rules(self):
         """Set up routing tables and rules"""
@@ -27,28 +108,33 @@ class AdvancedVPNNexusManager:
             # Check if tables already exist
             tables_exist = False
             try:
-                result = subprocess.run(["sudo", "cat", "/etc/iproute2/rt_tables"], capture_output=True, text=True, check=True)
-                if str(self.vpn1_table) in result.stdout and str(self.vpn2_table) in result.stdout:
-                    tables_exist = True
-            except subprocess.CalledProcessError as e:
+                # World-readable; parse table ids exactly so 1 doesn't match 11
+                with open("/etc/iproute2/rt_tables", "r") as f:
+                    existing = {int(fields[0]) for fields in map(str.split, f)
+                                if fields and fields[0].isdigit()}
+                tables_exist = self.vpn1_table in existing and self.vpn2_table in existing
+            except OSError as e:
                 logger.warning(f"Could not read routing tables: {e}")
 
             # Add tables if they don't exist
             if not tables_exist:
                 logger.info("Adding routing tables")
                 tables_content = f"\n{self.vpn1_table} vpn1\n{self.vpn2_table} vpn2\n"
-                subprocess.run(
+                run_quiet(
                     ["sudo", "bash", "-c", f"echo '{tables_content}' >> /etc/iproute2/rt_tables"],
                     check=True
                 )
 
             # Flush existing rules and routes
             logger.info("Cleaning up existing routes and rules")
-            subprocess.run(["sudo", "ip", "rule", "del", "table", str(self.vpn1_table)], check=False)
-            subprocess.run(["sudo", "ip", "rule", "del", "table", str(self.vpn2_table)], check=False)
+            # One sudo + ip process for all four; -force keeps going past missing rules
+            run_quiet(["sudo", "ip", "-force", "-batch", "-"], input=(
+                f"rule del table {self.vpn1_table}\n"
+                f"rule del table {self.vpn2_table}\n"
+                f"route flush table {self.vpn1_table}\n"
+                f"route flush table {self.vpn2_table}\n"
+            ))
             # subprocess.run(["sudo", "ip", "rule", "flush"], check=True)
-            subprocess.run(["sudo", "ip", "route", "flush", "table", str(self.vpn1_table)], check=False)
-            subprocess.run(["sudo", "ip", "route", "flush", "table", str(self.vpn2_table)], check=False)
 
             # # Restore default rule
             # subprocess.run(["sudo", "ip", "rule", "add", "from", "all", "lookup", "main"], check=True)
@@ -59,40 +145,48 @@ class AdvancedVPNNexusManager:
             logger.error(f"Failed to set up routing rules: {str(e)}")
             return False
 
-    def setup_vpn_chain(self, num_hops=2):
+    @staticmethod
+    async def _arun(cmd, check=False):
+        """Async counterpart of subprocess.run(cmd, capture_output=True, text=True)"""
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await proc.communicate()
+        result = subprocess.CompletedProcess(
+            cmd, proc.returncode,
+            stdout.decode(errors="replace"), stderr.decode(errors="replace")
+        )
+        if check:
+            result.check_returncode()
+        return result
+
+    async def setup_vpn_chain(self, num_hops=2):
         """Set up VPN + SOCKS proxy chain"""
+        # Reject before cleanup so a bad request doesn't tear down the running chain
+        if num_hops < 1:
+            logger.error(f"Failed to set up chain: num_hops must be at least 1, got {num_hops}")
+            return False
         try:
+            if tool_path("openvpn") is None:
+                raise Exception("openvpn binary not found")
+
             # Clean up any existing configuration
-            self.cleanup_vpn_chain()
+            await asyncio.to_thread(self.cleanup_vpn_chain)
 
             # Get first VPN
-            first_vpn = list(self.config.sections())[0]
-            vpn_config = self.config[first_vpn]['config_path']
+            first_vpn, first_settings = self.providers[0]
+            vpn_config = first_settings['config_path']
             if not vpn_config.startswith('/'):
-                vpn_config = str(self.base_path / vpn_config)
+                vpn_config = self.base_path / vpn_config
 
             # Start first VPN with logging
-            first_vpn_log = os.path.join(self.base_path, "logs",
-                                         "first_vpn.log")
+            first_vpn_log = self._first_log
             logger.info(f"Starting first VPN using config: {vpn_config}")
-            subprocess.run([
-                "sudo",
-                "openvpn",
-                "--config", vpn_config,
-                "--auth-user-pass",
-                "/home/anyone/.prjcts/pivpn-nexus/config/test/vpn-credentials.txt",
-                "--daemon",
-                "--verb", "4",
-                "--log", first_vpn_log
-            ], check=True)
+            await self._arun(openvpn_command(vpn_config, first_vpn_log, self._first_pid), check=True)
 
             # Wait for first VPN interface
-            if not self._wait_for_interface("tun0"):
-                # Read and log the OpenVPN output
-                if os.path.exists(first_vpn_log):
-                    with open(first_vpn_log, 'r') as f:
-                        vpn_output = f.read()
-                        logger.error(f"OpenVPN output:\n{vpn_output}")
+            if not await self._wait_for_interface("tun0"):
+                self._log_vpn_output("OpenVPN", first_vpn_log)
                 raise Exception(
                     "First VPN interface (tun0) failed to initialize")
 
@@ -100,31 +194,17 @@ class AdvancedVPNNexusManager:
 
             # Set up second hop if needed
             if num_hops > 1:
-                second_vpn = list(self.config.sections())[1]
+                second_vpn, second_settings = self.providers[1]
                 logger.info(f"Setting up second hop through {second_vpn}")
-                config_path = self.config[second_vpn]['config_path']
+                config_path = second_settings['config_path']
 
                 # Start second VPN
-                second_vpn_log = os.path.join(self.base_path, "logs",
-                                              "second_vpn.log")
-                subprocess.run([
-                    "sudo",
-                    "openvpn",
-                    "--config", config_path,
-                    "--auth-user-pass",
-                    "/home/anyone/.prjcts/pivpn-nexus/config/test/vpn-credentials.txt",
-                    "--daemon",
-                    "--verb", "4",
-                    "--log", second_vpn_log,
-                ], check=True)
+                second_vpn_log = self._second_log
+                await self._arun(openvpn_command(config_path, second_vpn_log, self._second_pid), check=True)
 
                 # Wait for second VPN interface
-                if not self._wait_for_interface("tun1"):
-                    # Read and log the OpenVPN output
-                    if os.path.exists(second_vpn_log):
-                        with open(second_vpn_log, 'r') as f:
-                            vpn_output = f.read()
-                            logger.error(f"Second VPN output:\n{vpn_output}")
+                if not await self._wait_for_interface("tun1"):
+                    self._log_vpn_output("Second VPN", second_vpn_log)
                     raise Exception(
                         "Second VPN interface (tun1) failed to initialize")
 
@@ -133,98 +213,217 @@ class AdvancedVPNNexusManager:
             # Log network configuration
             logger.info("Final network configuration:")
 
-            route_result = subprocess.run(["ip", "route", "show"],
-                                          capture_output=True, text=True)
+            tunnels = ["tun0", "tun1"] if num_hops > 1 else ["tun0"]
+            route_result, ifaces, tunnel_ips = await self._post_connect_probes(tunnels)
             logger.info(f"Routing table:\n{route_result.stdout}")
-
-            ifaces = subprocess.run(["ip", "addr"], capture_output=True,
-                                    text=True)
             logger.info(f"Network interfaces:\n{ifaces.stdout}")
 
             # Test connections
-            first_ip = subprocess.run(
-                ["curl", "--interface", "tun0", "--silent", "ifconfig.me"],
-                capture_output=True, text=True
-            )
-            logger.info(f"First VPN IP: {first_ip.stdout.strip()}")
-
-            if num_hops > 1:
-                second_ip = subprocess.run(
-                    ["curl", "--interface", "tun1", "--silent", "ifconfig.me"],
-                    capture_output=True, text=True
-                )
-                logger.info(f"Second VPN IP: {second_ip.stdout.strip()}")
+            for label, ip in zip(["First", "Second"], tunnel_ips):
+                logger.info(f"{label} VPN IP: {ip}")
 
+            self._active_tun = tunnels[-1]
+            # An answer cached while the chain was coming up describes the old exit
+            self._ip_cache = (0.0, None, None)
             return True
 
         except Exception as e:
             logger.error(f"Failed to set up chain: {str(e)}")
-            self.cleanup_vpn_chain()
+            await asyncio.to_thread(self.cleanup_vpn_chain)
             return False
 
-    def _wait_for_interface(self, interface, max_attempts=30):
+    @staticmethod
+    def _log_vpn_output(label, log_path, max_bytes=65536):
+        """Log the tail of an OpenVPN log; only the last lines explain a failure"""
+        try:
+            size = log_path.stat().st_size
+        except FileNotFoundError:
+            return
+        if not size:
+            return
+        with log_path.open('rb') as f:
+            f.seek(max(0, size - max_bytes))
+            tail = f.read().decode('utf-8', 'replace')
+        logger.error("%s output (tail):\n%s", label, tail)
+
+    async def _post_connect_probes(self, tunnels):
+        """Dump routes and interfaces and check the public IP of each tunnel, all at once"""
+        route_result, ifaces, *tunnel_ips = await asyncio.gather(
+            self._arun(SHOW_ROUTES),
+            self._arun(SHOW_INTERFACES),
+            *(asyncio.to_thread(self._check_ip, tun) for tun in tunnels)
+        )
+        return route_result, ifaces, tunnel_ips
+
+    @staticmethod
+    def _interface_address(interface):
+        """IPv4 address assigned to the interface, or None if unknown"""
+        if IPRoute is None:
+            return None
+        with IPRoute() as ipr:
+            addrs = ipr.get_addr(label=interface, family=socket.AF_INET)
+        return addrs[0].get_attr("IFA_LOCAL") if addrs else None
+
+    def _ip_client(self, interface, address):
+        """Keep-alive HTTP client whose connections leave through the interface, like curl --interface"""
+        with self._ip_clients_lock:
+            cached = self._ip_clients.get(interface)
+            if cached is not None and cached[0] == address:
+                return cached[1]
+            if cached is not None:
+                cached[1].close()
+            client = httpx.Client(
+                # local_address alone only picks the source IP; routing would still choose
+                # the egress tun, so pin the device as well
+                transport=httpx.HTTPTransport(
+                    local_address=address,
+                    socket_options=[(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, interface.encode())]
+                ),
+                timeout=10
+            )
+            self._ip_clients[interface] = (address, client)
+            return client
+
+    def _close_ip_clients(self):
+        with self._ip_clients_lock:
+            for _, client in self._ip_clients.values():
+                client.close()
+            self._ip_clients.clear()
+
+    def _check_ip(self, interface):
+        """Public IP seen through the interface, without forking curl when possible"""
+        address = self._interface_address(interface)
+        if address is None:
+            if tool_path("curl") is None:
+                logger.warning(f"Cannot check IP through {interface}: no address and no curl")
+                return ""
+            result = subprocess.run(check_ip_command(interface), capture_output=True, text=True)
+            return result.stdout.strip()
+        try:
+            response = self._ip_client(interface, address).get(IP_CHECK_URL)
+            return response.text.strip()
+        except httpx.HTTPError as e:
+            logger.warning(f"IP check through {interface} failed: {str(e)}")
+            return ""
+
+    async def _wait_for_interface(self, interface, max_attempts=30):
         """Wait for network interface to be available"""
         logger.info(f"Waiting for {interface} to be ready...")
+        if IPRoute is not None:
+            try:
+                return await self._wait_for_interface_netlink(interface, timeout=max_attempts)
+            except Exception as e:
+                logger.warning(f"Netlink wait for {interface} failed, polling instead: {str(e)}")
+
         for i in range(max_attempts):
             try:
-                result = subprocess.run(
-                    ["ip", "addr", "show", interface],
-                    capture_output=True,
-                    text=True,
-                    check=True
-                )
+                result = await self._arun(["ip", "addr", "show", interface], check=True)
                 if "inet" in result.stdout:
                     logger.info(f"{interface} is ready with IP configuration")
                     return True
             except subprocess.CalledProcessError:
                 pass
-            time.sleep(1)
+            await asyncio.sleep(1)
             logger.info(f"Waiting for {interface}... ({i + 1}/{max_attempts})")
         return False
 
+    @staticmethod
+    async def _wait_for_interface_netlink(interface, timeout):
+        """Block on link/address notifications instead of polling `ip addr`"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        changed = asyncio.Event()
+        with IPRoute() as monitor, IPRoute() as ipr:
+            monitor.bind()
+            loop.add_reader(monitor.fileno(), changed.set)
+            try:
+                while True:
+                    # Subscribed before this check, so an address added in between still wakes us
+                    if ipr.get_addr(label=interface, family=socket.AF_INET):
+                        logger.info(f"{interface} is ready with IP configuration")
+                        return True
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        return False
+                    changed.clear()
+                    try:
+                        await asyncio.wait_for(changed.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        continue
+                    monitor.get()
+            finally:
+                loop.remove_reader(monitor.fileno())
+
     def cleanup_vpn_chain(self):
         """Clean up processes"""
         try:
             # Stop OpenVPN processes
-            subprocess.run(["sudo", "killall", "openvpn"], check=False)
+            self._stop_openvpn_processes()
+            self._active_tun = None
+            # Tunnel addresses, and with them the exit IP, go away with the processes
+            self._ip_cache = (0.0, None, None)
+            self._close_ip_clients()
 
             # Remove log files
-            for log_file in ["first_vpn.log", "second_vpn.log"]:
-                log_path = os.path.join(self.base_path, "logs", log_file)
-                if os.path.exists(log_path):
-                    os.remove(log_path)
+            for log_path in self._log_files:
+                log_path.unlink(missing_ok=True)
 
             logger.info("VPN chain cleaned up")
         except Exception as e:
             logger.error(f"Error during cleanup: {str(e)}")
 
+    def _stop_openvpn_processes(self, grace_period=3):
+        """SIGTERM the daemons recorded in our pidfiles, SIGKILL any that outlive the grace period"""
+        pids = []
+        for pid_path in self._pid_files:
+            try:
+                pids.append(pid_path.read_text().strip())
+                pid_path.unlink(missing_ok=True)
+            except OSError:
+                continue
+        # A pidfile left over from a crash may name a PID since reused by another process
+        pids = [pid for pid in pids if pid.isdigit() and self._is_openvpn(pid)]
+        if not pids:
+            return
+
+        # The daemons run as root: one sudo for all of them
+        run_quiet(KILL_VPN + ("-TERM", *pids))
+        deadline = time.monotonic() + grace_period
+        while pids and time.monotonic() < deadline:
+            pids = [pid for pid in pids if self._is_openvpn(pid)]
+            if pids:
+                time.sleep(0.1)
+
+        if pids:
+            logger.warning(f"OpenVPN processes {', '.join(pids)} did not exit, sending SIGKILL")
+            run_quiet(KILL_VPN + ("-KILL", *pids))
+
+    @staticmethod
+    def _is_openvpn(pid):
+        """Whether the PID is currently an openvpn process"""
+        try:
+            with open(f"/proc/{pid}/comm") as f:
+                return f.read().strip() == "openvpn"
+        except OSError:
+            return False
+
     def get_current_ip(self):
         """Test the chain by checking current IP"""
         try:
-            # Check IP through second VPN if available
-            if "tun1" in subprocess.run(["ip", "link"], capture_output=True,
-                                        text=True).stdout:
-                logger.info("Checking IP through second VPN (tun1)")
-                result = subprocess.run([
-                    "curl",
-                    "--interface", "tun1",
-                    "--silent",
-                    "--max-time", "10",
-                    "ifconfig.me"
-                ], capture_output=True, text=True)
-            else:
-                # Check IP through first VPN
-                logger.info("Checking IP through first VPN (tun0)")
-                result = subprocess.run([
-                    "curl",
-                    "--interface", "tun0",
-                    "--silent",
-                    "--max-time", "10",
-                    "ifconfig.me"
-                ], capture_output=True, text=True)
-
-            logger.info(f"Current IP: {result.stdout.strip()}")
-            return result.stdout.strip()
+            interface = self._active_tun
+            if interface is None:
+                # Chain not started by us (e.g. before a restart): ask sysfs, no `ip link` fork
+                interface = "tun1" if os.path.exists("/sys/class/net/tun1") else "tun0"
+            # Keyed by interface too, so a check that raced chain setup can't outlive it
+            expiry, cached_interface, cached_ip = self._ip_cache
+            if cached_ip and cached_interface == interface and time.monotonic() < expiry:
+                return cached_ip
+            logger.info(f"Checking IP through {interface}")
+            ip = self._check_ip(interface)
+
+            logger.info(f"Current IP: {ip}")
+            self._ip_cache = (time.monotonic() + CURRENT_IP_TTL, interface, ip)
+            return ip
         except Exception as e:
             logger.error(f"Failed to get current IP: {str(e)}")
             return None
@@ -1,75 +1,196 @@
 import os
-import subprocess
+import re
+import select
+import socket
+import struct
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def icmp_checksum(data):
+    """RFC 1071 ones'-complement checksum"""
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def icmp_ping(host, timeout=1.0):
+    """
+    One echo request over an unprivileged ICMP datagram socket (no /bin/ping fork).
+    Raises PermissionError when net.ipv4.ping_group_range excludes us.
+    """
+    ident = os.getpid() & 0xFFFF
+    header = struct.pack('!BBHHH', 8, 0, 0, ident, 1)
+    payload = b'pivpn-nexus'
+    packet = struct.pack('!BBHHH', 8, 0, icmp_checksum(header + payload), ident, 1) + payload
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP) as sock:
+        sock.sendto(packet, (host, 0))
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            readable, _, _ = select.select([sock], [], [], remaining)
+            if not readable:
+                break
+            reply, _ = sock.recvfrom(1024)
+            # Datagram ICMP sockets deliver the ICMP header only; type 0 is echo reply
+            if reply[0] == 0:
+                return True
+    return False
+
+
+def tcp_ping(host, port, timeout=1.0):
+    """Reachability via TCP connect; a refused connection still proves the host answered"""
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout):
+            return True
+    except ConnectionRefusedError:
+        return True
+    except OSError:
+        return False
+
+
+def ping_host(host, port):
+    """Whether host answers within a second: ICMP echo, else a TCP connect to the VPN port"""
+    try:
+        # Resolve once up front so the ICMP probe and the TCP fallback share one lookup
+        address = socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_DGRAM)[0][4][0]
+        return icmp_ping(address)
+    except PermissionError:
+        return tcp_ping(address, port)
+    except OSError:
+        return False
+
+
+# Directives whose first argument is a file the config depends on
+REQUIRED_FILE_DIRECTIVES = frozenset({b'ca', b'cert', b'key', b'tls-auth', b'tls-crypt'})
+
+# Every directive the checker cares about, with up to two arguments; the
+# lookahead keeps e.g. key-direction from matching as key
+DIRECTIVE_RE = re.compile(
+    rb'^[ \t]*(ca|cert|key|tls-auth|tls-crypt|remote|auth-user-pass)(?!\S)'
+    rb'(?:[ \t]+(\S+)(?:[ \t]+(\S+))?)?',
+    re.M
+)
+
+# Credentials file referenced by auth-user-pass; PIVPN_CRED overrides the test default
+CREDENTIALS_PATH = os.environ.get(
+    'PIVPN_CRED', '/home/anyone/.prjcts/pivpn-nexus/config/test/vpn-credentials.txt')
+
+# Upper bound on how much of the credentials file is read to count its lines
+CREDENTIALS_READ_LIMIT = 4096
+
+# Three-digit octal permission strings, indexed by st_mode & 0o777
+MODE_STR = tuple(format(i, '03o') for i in range(0o1000))
+
+# Port OpenVPN assumes when a remote line omits it
+DEFAULT_OPENVPN_PORT = '1194'
 
 
 def check_openvpn_config(config_file):
+    # One read and one regex sweep: required files, remotes and auth together
     required_files = []
-    with open(config_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line.startswith('ca '):
-                required_files.append(line.split()[1])
-            elif line.startswith('cert '):
-                required_files.append(line.split()[1])
-            elif line.startswith('key '):
-                required_files.append(line.split()[1])
-            elif line.startswith('tls-auth '):
-                required_files.append(line.split()[1])
-            elif line.startswith('tls-crypt '):
-                required_files.append(line.split()[1])
-
-    print(f"\nChecking OpenVPN configuration: {config_file}")
-    print("-" * 50)
+    hosts = []
+    has_auth = False
+    with open(config_file, 'rb') as f:
+        data = f.read()
+    for m in DIRECTIVE_RE.finditer(data):
+        directive, arg, extra = m.groups()
+        if directive in REQUIRED_FILE_DIRECTIVES and arg:
+            required_files.append(os.fsdecode(arg))
+        elif directive == b'remote' and arg:
+            hosts.append((arg.decode(), extra.decode() if extra else DEFAULT_OPENVPN_PORT))
+        elif directive == b'auth-user-pass':
+            has_auth = True
+
+    # Report lines are buffered and written in a couple of writes, not one per line
+    out = []
+    append = out.append
+    append(f"\nChecking OpenVPN configuration: {config_file}")
+    append("-" * 50)
 
     # Check for auth-user-pass directive
-    with open(config_file, 'r') as f:
-        config_content = f.read()
-        if 'auth-user-pass' in config_content:
-            print("Auth-user-pass directive found - credentials file required")
-            if os.path.exists('/home/anyone/.prjcts/pivpn-nexus/config/test/vpn-credentials.txt'):
-                print("✓ Credentials file found")
-                # Check credentials file format
-                with open('/home/anyone/.prjcts/pivpn-nexus/config/test/vpn-credentials.txt', 'r') as cred_file:
-                    lines = cred_file.readlines()
-                    if len(lines) == 2:
-                        print("✓ Credentials file format appears correct")
-                    else:
-                        print(
-                            "✗ Credentials file should contain exactly 2 lines")
+    if has_auth:
+        append("Auth-user-pass directive found - credentials file required")
+        # Opening is the existence check: one path walk instead of exists() then open()
+        try:
+            cred_file = open(CREDENTIALS_PATH, 'rb')
+        except FileNotFoundError:
+            append("✗ Missing vpn-credentials.txt file")
+        else:
+            append("✓ Credentials file found")
+            # Check credentials file format; a bounded read is plenty for a username and password
+            with cred_file:
+                buf = cred_file.read(CREDENTIALS_READ_LIMIT)
+            line_count = buf.count(b'\n') + (0 if not buf or buf.endswith(b'\n') else 1)
+            if line_count == 2:
+                append("✓ Credentials file format appears correct")
             else:
-                print("✗ Missing vpn-credentials.txt file")
+                append(
+                    "✗ Credentials file should contain exactly 2 lines")
 
-    # Check for required files
-    print("\nChecking required certificate/key files:")
+    # One readdir answers existence for everything beside the config; only
+    # files that are actually present get stat'ed, and only once
     config_dir = os.path.dirname(config_file)
+    try:
+        with os.scandir(config_dir or '.') as it:
+            entries = {e.name: e for e in it}
+    except OSError:
+        entries = {}
+    stats = {}
+    for file in [config_file] + [os.path.join(config_dir, f) for f in
+                                 required_files]:
+        if file in stats:
+            continue
+        name = os.path.basename(file)
+        try:
+            if os.path.dirname(file) == config_dir:
+                entry = entries.get(name)
+                stats[file] = entry.stat() if entry is not None else None
+            else:
+                # Subdirectory or absolute path: not covered by the scan
+                stats[file] = os.stat(file)
+        except OSError:
+            stats[file] = None
+
+    # Check for required files
+    append("\nChecking required certificate/key files:")
     for file in required_files:
-        file_path = os.path.join(config_dir, file)
-        if os.path.exists(file_path):
-            print(f"✓ Found: {file}")
+        if stats[os.path.join(config_dir, file)] is not None:
+            append(f"✓ Found: {file}")
         else:
-            print(f"✗ Missing: {file}")
+            append(f"✗ Missing: {file}")
 
     # Check file permissions
-    print("\nChecking file permissions:")
-    for file in [config_file] + [os.path.join(config_dir, f) for f in
-                                 required_files]:
-        if os.path.exists(file):
-            perms = oct(os.stat(file).st_mode)[-3:]
-            print(f"{file}: {perms}")
+    append("\nChecking file permissions:")
+    for file, st in stats.items():
+        if st is not None:
+            perms = MODE_STR[st.st_mode & 0o777]
+            append(f"{file}: {perms}")
 
     # Test network connectivity
-    print("\nTesting network connectivity to VPN server:")
-    with open(config_file, 'r') as f:
-        for line in f:
-            if line.startswith('remote '):
-                _, host, port = line.split()
-                try:
-                    subprocess.run(['ping', '-c', '1', host], check=True,
-                                   capture_output=True)
-                    print(f"✓ Can reach {host}")
-                except subprocess.CalledProcessError:
-                    print(f"✗ Cannot reach {host}")
+    append("\nTesting network connectivity to VPN server:")
+    # Flush the static report in one write so it is visible while the pings run
+    sys.stdout.write("\n".join(out) + "\n")
+    out.clear()
+    # Failover configs list one host on several ports; probe each host once,
+    # keeping its first port for the TCP fallback
+    unique_hosts = {}
+    for host, port in hosts:
+        unique_hosts.setdefault(host, port)
+    if unique_hosts:
+        # Ping every remote at once: total wait is the slowest RTT, not the sum
+        with ThreadPoolExecutor(max_workers=len(unique_hosts)) as executor:
+            # map() yields in submission order, so results print in config order
+            results = executor.map(ping_host, unique_hosts.keys(), unique_hosts.values())
+            for host, reachable in zip(unique_hosts, results):
+                if reachable:
+                    append(f"✓ Can reach {host}")
+                else:
+                    append(f"✗ Cannot reach {host}")
+        sys.stdout.write("\n".join(out) + "\n")
 
 
 if __name__ == "__main__":
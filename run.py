@@ -1,9 +1,15 @@
+import os
+
 import uvicorn
 from app.main import app
-from app.logging_utility import logger
 
 
 if __name__=='__main__':
-    logger.info("Starting PiVPN Nexus application")
-    # uvicorn.run(app, host='0.0.0.0', port=8000)
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    # The reloader forks a watcher process and re-imports the app; development only
+    reload = os.getenv("PIVPN_DEV") == "1"
+    # Chain setup/teardown is serialized by a per-process lock, so one worker is the safe default
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    # reload and multiple workers need an import string; otherwise serve the loaded app
+    target = "app.main:app" if reload or workers > 1 else app
+    uvicorn.run(target, host="0.0.0.0", port=8000, reload=reload, workers=workers,
+                loop="uvloop", http="httptools", access_log=reload)